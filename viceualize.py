@@ -11,75 +11,201 @@ License: MIT
 """
 
 import glob
+import hashlib
 import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 
+import numpy as np
+import openpyxl
 import pandas as pd
 import plotly.graph_objects as go
 
+CACHE_DIR = ".cache"
+# Bump whenever the output of _read_sheet changes so stale cached frames are not reused
+CACHE_VERSION = 3
+
+
+def _read_sheet(file_path):
+    """Read columns A-E of a .ods or .xlsx file into a DataFrame."""
+    if file_path.endswith(".xlsx"):
+        # Stream the first sheet row by row instead of loading the whole workbook
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(min_row=2, max_col=5, values_only=True)
+            df = pd.DataFrame(rows, columns=[0, 1, 2, 3, 4])
+        finally:
+            wb.close()  # Release the zipfile handle
+        # Trim only the trailing empty rows read-only mode can pad with; blank rows in the
+        # middle are kept (and counted as date errors), matching read_excel on .ods files
+        non_empty = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+        return df.iloc[: non_empty[-1] + 1 if non_empty.size else 0]
+
+    # Only columns A-E are used; parse the date column during the read and leave B-E
+    # as raw objects, since they are coerced to numbers in a single pass afterwards
+    return pd.read_excel(
+        file_path,
+        engine="odf",
+        skiprows=1,
+        header=None,
+        usecols=[0, 1, 2, 3, 4],
+        parse_dates=[0],
+        dtype={1: object, 2: object, 3: object, 4: object},
+    )
+
+
+def _load_cached(file_path):
+    """Return the parsed sheet, reusing its on-disk cache while the format version, mtime and size match."""
+    # One cache file per sheet path; edits overwrite it instead of adding new entries
+    key = hashlib.blake2b(os.path.abspath(file_path).encode()).hexdigest()
+    cache_path = os.path.join(os.path.dirname(file_path), CACHE_DIR, f"{key}.pkl")
+    stamp = (CACHE_VERSION, os.path.getmtime(file_path), os.path.getsize(file_path))
+    if os.path.exists(cache_path):
+        try:
+            cached_stamp, cached_df = pd.read_pickle(cache_path)
+            if cached_stamp == stamp:
+                return cached_df
+        except Exception:
+            pass  # Truncated or unreadable cache; re-parse the sheet and overwrite it
+
+    df = _read_sheet(file_path)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temp file and swap it in so an interrupted run never leaves a partial cache
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+        os.close(fd)
+        try:
+            pd.to_pickle((stamp, df), tmp_path)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Warning: Could not write cache for {os.path.basename(file_path)}: {str(e)}")
+    return df
+
+
+def _process_one(file_path):
+    """Process a single .ods or .xlsx file, in a worker process when there are several.
+
+    Returns (filename, data, num_rows, num_date_errors, messages), where data is a
+    (dates, sums) pair of arrays sorted by date, or None if the file could not be
+    read. Messages are returned instead of printed so the parent process can keep
+    stdout in order.
+    """
+    filename = os.path.basename(file_path)
+    messages = []
+
+    try:
+        df = _load_cached(file_path)
+    except Exception as e:
+        messages.append(f"Error reading {filename}: {str(e)}")
+        return filename, None, 0, 0, messages
+
+    # Process dates in bulk
+    dates = pd.to_datetime(df[0], errors="coerce")
+    valid_dates = dates.notna().to_numpy()
+    # Work with row positions and plain arrays rather than a filtered copy of the frame
+    idx = np.flatnonzero(valid_dates)
+    row_numbers = df.index[idx] + 2  # Adjust for header row
+    # Keep plain day-precision datetime64 values instead of Timestamp objects
+    dates = dates.to_numpy()[idx].astype("datetime64[D]")
+
+    # Process numeric columns in bulk: coerce all four columns (B-E) in a single call
+    flat = pd.to_numeric(df.iloc[idx, 1:5].to_numpy().ravel(), errors="coerce")
+    arr = flat.reshape(-1, 4)
+    # Branchless masking: one mask of missing, infinite or fractional cells drives both
+    # the zero-fill and the invalid counts, so no value is silently truncated by the cast
+    invalid_mask = ~np.isfinite(arr) | (arr != np.trunc(arr))
+    invalid_counts = invalid_mask.sum(axis=1)
+    # np.where returns a fresh C-contiguous block for the raw ufunc reduction
+    arr = np.where(invalid_mask, 0, arr).astype(np.int64, copy=False)
+    sums = np.add.reduce(arr, axis=1)
+
+    # Handle invalid cells (only the flagged subset is iterated)
+    flagged = invalid_counts > 0
+    for count, row_number in zip(invalid_counts[flagged], row_numbers[flagged]):
+        messages.append(f"Warning: {count} non-integer value(s) in columns B-E of "
+                        f"row {row_number} in {filename}. Treated as 0.")
+
+    # Deduplicate in one sort with the last entry winning; np.unique also yields date order
+    _, last_in_reversed = np.unique(dates[::-1], return_index=True)
+    keep_idx = len(dates) - 1 - last_in_reversed
+
+    # Handle duplicate dates (only scanned when there are any)
+    if len(keep_idx) < len(dates):
+        _, first_idx = np.unique(dates, return_index=True)
+        duplicated = np.ones(len(dates), dtype=bool)
+        duplicated[first_idx] = False
+        for date, row_number in zip(dates[duplicated], row_numbers[duplicated]):
+            messages.append(f"Warning: Duplicate date {date} in row {row_number} of {filename}. "
+                            f"Overwriting previous entry.")
+
+    num_date_errors = int((~valid_dates).sum())
+
+    return filename, (dates[keep_idx], sums[keep_idx]), len(dates), num_date_errors, messages
+
+
+def _build_table(filenames, dates_list, sums_list):
+    """Stack per-file date/sum arrays into one columnar table with a categorical file column."""
+    lengths = [len(dates) for dates in dates_list]
+    codes = np.repeat(np.arange(len(filenames), dtype=np.int16), lengths)
+    return pd.DataFrame({
+        "file": pd.Categorical.from_codes(codes, categories=filenames),
+        "date": np.concatenate(dates_list) if dates_list else np.array([], dtype="datetime64[D]"),
+        "sum": np.concatenate(sums_list) if sums_list else np.array([], dtype=np.int64),
+    })
+
 
 def process_files(directory="."):
-    """Process all .ods and .xlsx files in the specified directory using vectorized operations."""
-    head_dict = {}
+    """Process all .ods and .xlsx files in the specified directory, using a process pool for several files.
+
+    Returns a single table with one row per date and the columns file, date and sum.
+    """
+    filenames = []
+    dates_list = []
+    sums_list = []
     file_list = []
     for ext in ["*.ods", "*.xlsx"]:
         file_list.extend(glob.glob(os.path.join(directory, ext)))
 
     if not file_list:
         print("No .ods or .xlsx files found in the directory.")
-        return head_dict
+        return _build_table(filenames, dates_list, sums_list)
 
-    for file_path in file_list:
-        filename = os.path.basename(file_path)
-        print(f"\nProcessing file: {filename}")
+    # Files are independent, so parse several in parallel and print from the parent only.
+    # A single file is processed in-process, where pool startup would dominate the run time.
+    with ExitStack() as stack:
+        if len(file_list) > 1:
+            max_workers = min(len(file_list), os.cpu_count() or 1)
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers))
+            results = executor.map(_process_one, file_list)
+        else:
+            results = map(_process_one, file_list)
 
-        # Determine the appropriate engine for reading the file
-        engine = "odf" if file_path.endswith(".ods") else "openpyxl"
-        try:
-            df = pd.read_excel(file_path, engine=engine, skiprows=1, header=None)
-        except Exception as e:
-            print(f"Error reading {filename}: {str(e)}")
-            continue
-
-        # Process dates in bulk
-        df[0] = pd.to_datetime(df[0], errors="coerce")
-        valid_dates = df[0].notna()
-        df_valid = df[valid_dates].copy()
-        
-        # Store original indices for error reporting
-        df_valid['original_index'] = df_valid.index + 2  # Adjust for header row
-
-        # Process numeric columns in bulk
-        cols = [1, 2, 3, 4]
-        df_numeric = df_valid[cols].apply(pd.to_numeric, errors="coerce")
-        df_valid['sum_val'] = df_numeric.sum(axis=1)
-        df_valid['invalid_count'] = df_numeric.isna().sum(axis=1)
-
-        # Handle invalid cells
-        invalid_rows = df_valid[df_valid['invalid_count'] > 0]
-        for _, row in invalid_rows.iterrows():
-            print(f"Warning: {row['invalid_count']} non-integer value(s) in columns B-E of "
-                  f"row {row['original_index']} in {filename}. Treated as 0.")
-
-        # Handle duplicate dates
-        duplicates = df_valid[df_valid.duplicated(subset=[0], keep='first')]
-        for _, row in duplicates.iterrows():
-            print(f"Warning: Duplicate date {row[0]} in row {row['original_index']} of {filename}. "
-                  f"Overwriting previous entry.")
-
-        # Create final data structure
-        data_dict = df_valid.set_index(0)['sum_val'].to_dict()
-        num_date_errors = (~valid_dates).sum()
-
-        print(f"Processed {len(df_valid)} valid rows from {filename} with {num_date_errors} date errors.")
-        head_dict[filename] = data_dict
-
-    return head_dict
-
-
-def plot_data(head_dict):
-    """Create an interactive Plotly figure with zoom/scroll functionality and color segments by month."""
-    if not head_dict:
+        for filename, data, num_rows, num_date_errors, messages in results:
+            # Emit each file's report with a single write
+            report = [f"\nProcessing file: {filename}", *messages]
+            if data is not None:
+                report.append(f"Processed {num_rows} valid rows from {filename} with {num_date_errors} date errors.")
+            sys.stdout.write("\n".join(report) + "\n")
+            if data is None:
+                continue
+
+            filenames.append(filename)
+            dates_list.append(data[0])
+            sums_list.append(data[1])
+
+    return _build_table(filenames, dates_list, sums_list)
+
+
+def plot_data(df):
+    """Create an interactive Plotly figure with zoom/scroll functionality and color points by month."""
+    if df.empty:
         print("No data available to plot.")
         return
 
@@ -100,61 +226,35 @@ def plot_data(head_dict):
         11: 'goldenrod',
         12: 'green'
     }
+    # Lookup table indexed by month - 1 for coloring whole arrays at once
+    month_colors = np.array([month_to_color[month] for month in range(1, 13)])
 
-    # Create sorted list of files based on their earliest date
-    sorted_files = sorted(
-        [(fn, data) for fn, data in head_dict.items() if data],
-        key=lambda x: min(x[1].keys()),  # Sort by earliest date
-        # or sort by latest date: key=lambda x: max(x[1].keys())
-    )
+    # Order files by their earliest date; rows are date-sorted within each file,
+    # so the first date of each group is its minimum
+    groups = df.groupby("file", observed=True, sort=False)
+    sorted_files = groups["date"].first().sort_values(kind="stable").index
+    # or sort by latest date: groups["date"].last().sort_values(kind="stable").index
 
-    for filename, data_dict in sorted_files:
-        if not data_dict:
-            print(f"Skipping {filename} as it contains no valid data.")
-            continue
-
-        # Sort data by date
-        sorted_dates = sorted(data_dict.keys())
-        sorted_sums = [data_dict[date] for date in sorted_dates]
-
-        # Group data into segments where the month is continuous
-        current_month = None
-        segment_dates = []
-        segment_sums = []
-        for date, sum_val in zip(sorted_dates, sorted_sums):
-            month = date.month
-            if current_month is None:
-                current_month = month
-            if month != current_month:
-                # Plot the current segment
-                fig.add_trace(
-                    go.Scatter(
-                        x=segment_dates,
-                        y=segment_sums,
-                        mode="lines+markers",
-                        name=f"{filename} - {current_month:02d}",
-                        line=dict(color=month_to_color.get(current_month, 'black')),
-                        hovertemplate=f"Date: %{{x|%Y-%m-%d}}<br>Sum: %{{y}}<br>Month: {current_month:02d}<extra></extra>"
-                    )
-                )
-                # Reset segment for new month
-                segment_dates = []
-                segment_sums = []
-                current_month = month
-            segment_dates.append(date)
-            segment_sums.append(sum_val)
-        # Plot the final segment
-        if segment_dates:
-            fig.add_trace(
-                go.Scatter(
-                    x=segment_dates,
-                    y=segment_sums,
-                    mode="lines+markers",
-                    name=f"{filename} - {current_month:02d}",
-                    line=dict(color=month_to_color.get(current_month, 'black')),
-                    hovertemplate=f"Date: %{{x|%Y-%m-%d}}<br>Sum: %{{y}}<br>Month: {current_month:02d}<extra></extra>"
-                )
+    for filename in sorted_files:
+        sub = groups.get_group(filename)
+        # Rows arrive sorted by date within each file; derive month numbers (1-12) in one pass
+        sorted_dates = sub["date"].to_numpy()
+        sorted_sums = sub["sum"].to_numpy()
+        months = sorted_dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+        # One trace per file; each point is colored by its month
+        fig.add_trace(
+            go.Scatter(
+                x=sorted_dates,
+                y=sorted_sums,
+                mode="lines+markers",
+                name=filename,
+                marker=dict(color=month_colors[months - 1]),
+                line=dict(color='lightgray'),
+                customdata=months,
+                hovertemplate="Date: %{x|%Y-%m-%d}<br>Sum: %{y}<br>Month: %{customdata:02d}<extra></extra>"
             )
+        )
 
     # Configure layout with time slider and zoom tools
     fig.update_layout(
@@ -192,10 +292,16 @@ def plot_data(head_dict):
     )
 
     fig.show()
-    fig.write_html(
-        f"assets/Cannabis-Use-Statistics-{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
-    )  # Create backup
-    fig.write_html("assets/index.html")  # Export main page
+    backup_path = f"assets/Cannabis-Use-Statistics-{datetime.now().strftime('%Y%m%d_%H%M%S')}.html"
+    fig.write_html(backup_path, include_plotlyjs="cdn")  # Create backup
+    # Export main page by linking to the backup instead of serializing the figure again
+    index_path = "assets/index.html"
+    if os.path.lexists(index_path):
+        os.unlink(index_path)
+    try:
+        os.link(backup_path, index_path)
+    except OSError:
+        shutil.copyfile(backup_path, index_path)
 
 
 if __name__ == "__main__":